@@ -1,42 +1,37 @@
 import os
 import io
 import json
+try:
+    import orjson  # faster parsing of the large sample lists
+except ImportError:
+    orjson = None
 import torch
 from math import pi
 import numpy as np
-from scipy.interpolate import interp1d
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 cv2.setNumThreads(0)
 cv2.ocl.setUseOpenCL(False)
 
-from PIL import Image
-from torch.utils.data import Dataset
-from torchvision import transforms
-from utils import warp, generate_random_params_for_warp
+from torch.utils.data import Dataset, get_worker_info
+from utils import warp, generate_random_params_for_warp, ResizeToTensor
 from view_transform import calibration
 
-import utils_comma2k19.orientation as orient
+from utils_comma2k19.orientation_fast import batch_rot_from_quat
 import utils_comma2k19.coordinates as coord
 
 
 class PlanningDataset(Dataset):
     def __init__(self, root='data', json_path_pattern='p3_%s.json', split='train'):
-        self.samples = json.load(open(os.path.join(root, json_path_pattern % split)))
+        self.samples = self._load_json(os.path.join(root, json_path_pattern % split))
         print('PlanningDataset: %d samples loaded from %s' % 
               (len(self.samples), os.path.join(root, json_path_pattern % split)))
         self.split = split
+        self._init_camera_params_(self.samples)
+        self._init_future_poses_(self.samples)
 
         self.img_root = os.path.join(root, 'nuscenes')
-        self.transforms = transforms.Compose(
-            [
-                # transforms.Resize((900 // 2, 1600 // 2)),
-                # transforms.Resize((9 * 32, 16 * 32)),
-                transforms.Resize((128, 256)),
-                transforms.ToTensor(),
-                transforms.Normalize([0.3890, 0.3937, 0.3851],
-                                     [0.2172, 0.2141, 0.2209]),
-            ]
-        )
+        self.transforms = ResizeToTensor((128, 256))  # uint8, normalized on the GPU
 
         self.enable_aug = False
         self.view_transform = False
@@ -50,30 +45,76 @@ class PlanningDataset(Dataset):
         self.client = Client('~/petreloss.conf')
         print('======== Initializing Memcache: Success =======')
 
+    @staticmethod
+    def _load_json(path):
+        if orjson is not None:
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(path) as f:
+            return json.load(f)
+
+    def _init_future_poses_(self, samples):
+        # parsed once into a single float32 array, the nested lists are dropped
+        self.future_poses = np.stack([np.asarray(smp.pop('future_poses'), dtype=np.float32) for smp in samples])
+
+    def _init_camera_params_(self, samples):
+        # constant calibration per sample, converted once instead of in every __getitem__
+        self.camera_params = {
+            k: np.stack([np.asarray(smp[k], dtype=np.float32) for smp in samples])
+            for k in ('camera_intrinsic', 'camera_extrinsic', 'camera_translation_inv', 'camera_rotation_matrix_inv')
+        }
+        self.calibration_samples = samples
+        self.warp_matrices = None  # only needed with the view transform, see _get_warp_matrix
+
+    def _get_warp_matrix(self, idx):
+        if self.warp_matrices is None:
+            self._init_warp_matrices_(self.calibration_samples)
+        return self.warp_matrices[idx]
+
+    def _init_warp_matrices_(self, samples):
+        # warp matrices for the view transform only depend on the calibration, built from the full precision values
+        camera_params = {
+            k: np.stack([np.asarray(smp[k], dtype=np.float64) for smp in samples])
+            for k in ('camera_intrinsic', 'camera_translation_inv', 'camera_rotation_matrix_inv')
+        }
+        camera_rotation_matrix = np.linalg.inv(camera_params['camera_rotation_matrix_inv'])
+        camera_translation = -camera_params['camera_translation_inv']
+        camera_extrinsic = np.zeros((len(samples), 4, 4))
+        camera_extrinsic[:, :3, :3] = camera_rotation_matrix
+        camera_extrinsic[:, :3, 3] = camera_translation
+        camera_extrinsic[:, 3, 3] = 1
+        camera_extrinsic = np.linalg.inv(camera_extrinsic)
+        self.warp_matrices = np.stack([
+            calibration(extrinsic, intrinsic)
+            for extrinsic, intrinsic in zip(camera_extrinsic, camera_params['camera_intrinsic'])
+        ])
+
     def _get_cv2_image(self, path):
+        # libjpeg-turbo decodes straight to 1/4 size in the DCT domain (400x225 for nuScenes, still above 256x128).
+        # The view transform needs full resolution, its warp matrix is defined in camera pixels.
+        flags = cv2.IMREAD_COLOR if self.view_transform else cv2.IMREAD_REDUCED_COLOR_4
         if self.use_memcache:
             img_bytes = self.client.get(str(path))
             assert(img_bytes is not None)
             img_mem_view = memoryview(img_bytes)
             img_array = np.frombuffer(img_mem_view, np.uint8)
-            return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+            return cv2.imdecode(img_array, flags)
 
         else:
-            return cv2.imread(path)
+            return cv2.imread(path, flags)
 
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
         sample = self.samples[idx]
-        imgs, future_poses = sample['imgs'], sample['future_poses']
+        imgs = sample['imgs']
 
         # process future_poses
-        future_poses = torch.tensor(future_poses)
+        future_poses = torch.from_numpy(self.future_poses[idx].copy())  # modified in-place below
         future_poses[:, 0] = future_poses[:, 0].clamp(1e-2, )  # the car will never go backward
 
-        imgs = list(self._get_cv2_image(os.path.join(self.img_root, p)) for p in imgs)
-        imgs = list(cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in imgs)  # RGB
+        imgs = list(self._get_cv2_image(os.path.join(self.img_root, p)) for p in imgs)  # BGR
 
         # process images
         if self.enable_aug and self.split == 'train':
@@ -89,73 +130,87 @@ class PlanningDataset(Dataset):
             
 
         if self.view_transform:
-            camera_rotation_matrix = np.linalg.inv(np.array(sample["camera_rotation_matrix_inv"]))
-            camera_translation = -np.array(sample["camera_translation_inv"])
-            camera_extrinsic = np.vstack((np.hstack((camera_rotation_matrix, camera_translation.reshape((3, 1)))), np.array([0, 0, 0, 1])))
-            camera_extrinsic = np.linalg.inv(camera_extrinsic)
-            warp_matrix = calibration(camera_extrinsic, np.array(sample["camera_intrinsic"]))
+            warp_matrix = self._get_warp_matrix(idx)
             imgs = list(cv2.warpPerspective(src = img, M = warp_matrix, dsize= (256,128), flags= cv2.WARP_INVERSE_MAP) for img in imgs)
 
-        # cvt back to PIL images
         # cv2.imshow('0', imgs[0])
         # cv2.imshow('1', imgs[1])
         # cv2.waitKey(0)
-        imgs = list(Image.fromarray(img) for img in imgs)
-        imgs = list(self.transforms(img) for img in imgs)
-        input_img = torch.cat(imgs, dim=0)
+        input_img = self.transforms(imgs, bgr=True).flatten(0, 1)  # [N*3, H, W], RGB, uint8
 
         return dict(
             input_img=input_img,
             future_poses=future_poses,
-            camera_intrinsic=torch.tensor(sample['camera_intrinsic']),
-            camera_extrinsic=torch.tensor(sample['camera_extrinsic']),
-            camera_translation_inv=torch.tensor(sample['camera_translation_inv']),
-            camera_rotation_matrix_inv=torch.tensor(sample['camera_rotation_matrix_inv']),
+            **{k: torch.from_numpy(v[idx]) for k, v in self.camera_params.items()},
         )
 
 
 class SequencePlanningDataset(PlanningDataset):
-    def __init__(self, root='data', json_path_pattern='p3_%s.json', split='train'):
+    def __init__(self, root='data', json_path_pattern='p3_%s.json', split='train', decode_threads=None):
         print('Sequence', end='')
         self.fix_seq_length = 18
+        # None: the CPUs of this process split evenly among the DataLoader workers
+        self.decode_threads = decode_threads
+        self._pool, self._pool_pid = None, None
         super().__init__(root=root, json_path_pattern=json_path_pattern, split=split)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None  # threads cannot be pickled, every worker creates its own pool
+        return state
+
+    def _get_decode_pool(self):
+        # created once per process, a forked worker does not inherit the threads of its parent
+        if self._pool is None or self._pool_pid != os.getpid():
+            decode_threads = self.decode_threads
+            if decode_threads is None:
+                worker_info = get_worker_info()
+                num_workers = worker_info.num_workers if worker_info is not None else 1
+                decode_threads = max(1, len(os.sched_getaffinity(0)) // num_workers)
+            self._pool, self._pool_pid = ThreadPoolExecutor(max_workers=decode_threads), os.getpid()
+        return self._pool
+
+    def _init_camera_params_(self, samples):
+        # the calibration does not change within a sequence
+        super()._init_camera_params_([seq_samples[0] for seq_samples in samples])
+
+    def _init_future_poses_(self, samples):
+        self.future_poses = [
+            np.stack([np.asarray(smp.pop('future_poses'), dtype=np.float32) for smp in seq_samples])
+            for seq_samples in samples
+        ]
+
     def __getitem__(self, idx):
         seq_samples = self.samples[idx]
         seq_length = len(seq_samples)
         if seq_length < self.fix_seq_length:
             # Only 1 sample < 28 (==21)
             return self.__getitem__(np.random.randint(0, len(self.samples)))
+        seq_length_delta = 0
         if seq_length > self.fix_seq_length:
             seq_length_delta = seq_length - self.fix_seq_length
             seq_length_delta = np.random.randint(0, seq_length_delta+1)
             seq_samples = seq_samples[seq_length_delta:self.fix_seq_length+seq_length_delta]
 
-        seq_future_poses = list(smp['future_poses'] for smp in seq_samples)
+        seq_future_poses = self.future_poses[idx][seq_length_delta:self.fix_seq_length+seq_length_delta]
         seq_imgs = list(smp['imgs'] for smp in seq_samples)
 
-        seq_input_img = []
-        for imgs in seq_imgs:
-            imgs = list(self._get_cv2_image(os.path.join(self.img_root, p)) for p in imgs)
-            imgs = list(cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in imgs)  # RGB
-            imgs = list(Image.fromarray(img) for img in imgs)
-            imgs = list(self.transforms(img) for img in imgs)
-            input_img = torch.cat(imgs, dim=0)
-            seq_input_img.append(input_img[None])
-        seq_input_img = torch.cat(seq_input_img)
+        # decode all frames of the sequence at once, cv2 releases the GIL while decoding
+        paths = [os.path.join(self.img_root, p) for imgs in seq_imgs for p in imgs]
+        imgs = list(self._get_decode_pool().map(self._get_cv2_image, paths))
+        seq_input_img = self.transforms(imgs, bgr=True)  # [seq_len * n_frames, 3, H, W]
+        seq_input_img = seq_input_img.view(len(seq_imgs), -1, *seq_input_img.shape[-2:])
 
         return dict(
             seq_input_img=seq_input_img,  # torch.Size([28, 10, 3])
-            seq_future_poses=torch.tensor(seq_future_poses),  # torch.Size([28, 6, 128, 256])
-            camera_intrinsic=torch.tensor(seq_samples[0]['camera_intrinsic']),
-            camera_extrinsic=torch.tensor(seq_samples[0]['camera_extrinsic']),
-            camera_translation_inv=torch.tensor(seq_samples[0]['camera_translation_inv']),
-            camera_rotation_matrix_inv=torch.tensor(seq_samples[0]['camera_rotation_matrix_inv']),
+            seq_future_poses=torch.from_numpy(seq_future_poses),  # torch.Size([28, 6, 128, 256])
+            # the calibration is not used in training, it is kept in self.camera_params[k][idx]
         )
 
 
 class Comma2k19SequenceDataset(PlanningDataset):
-    def __init__(self, split_txt_path, prefix, mode, use_memcache=True, return_origin=False):
+    def __init__(self, split_txt_path, prefix, mode, use_memcache=True, return_origin=False, use_nvdec=False, gpu_id=0,
+                 cache_dir=None, cache_size_gb=16):
         self.split_txt_path = split_txt_path
         self.prefix = prefix
 
@@ -169,16 +224,7 @@ class Comma2k19SequenceDataset(PlanningDataset):
 
         self.fix_seq_length = 800 if mode == 'train' else 800
 
-        self.transforms = transforms.Compose(
-            [
-                # transforms.Resize((900 // 2, 1600 // 2)),
-                # transforms.Resize((9 * 32, 16 * 32)),
-                transforms.Resize((128, 256)),
-                transforms.ToTensor(),
-                transforms.Normalize([0.3890, 0.3937, 0.3851],
-                                     [0.2172, 0.2141, 0.2209]),
-            ]
-        )
+        self.transforms = ResizeToTensor((128, 256))  # uint8, normalized on the GPU
 
         self.warp_matrix = calibration(extrinsic_matrix=np.array([[ 0, -1,  0,    0],
                                                                   [ 0,  0, -1, 1.22],
@@ -195,6 +241,18 @@ class Comma2k19SequenceDataset(PlanningDataset):
 
         self.return_origin = return_origin
 
+        # hardware (NVDEC) decoding through ffmpegcv, local files only
+        self.use_nvdec = use_nvdec and not self.use_memcache
+        self.gpu_id = gpu_id
+
+        # decoded frames of (sequence, start frame) pairs, best put on a tmpfs or a local SSD.
+        # Only for the demo mode, where the start frame is fixed: random training windows would hardly ever hit.
+        assert cache_dir is None or mode == 'demo', 'the frame cache is only supported in demo mode'
+        self.cache_dir = cache_dir
+        self.cache_size_gb = cache_size_gb
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
         # from OpenPilot
         self.num_pts = 10 * 20  # 10 s * 20 Hz = 200 frames
         self.t_anchors = np.array(
@@ -207,11 +265,16 @@ class Comma2k19SequenceDataset(PlanningDataset):
              8.7890625 ,  9.38476562, 10.)
         )
         self.t_idx = np.linspace(0, 10, num=self.num_pts)
+        # linear interpolation from t_idx to t_anchors as a [len(t_anchors), num_pts] matrix
+        self.interp_weights = np.stack([np.interp(self.t_anchors, self.t_idx, e) for e in np.eye(self.num_pts)], axis=1)
 
 
     def _get_cv2_vid(self, path):
         if self.use_memcache:
             path = self.client.generate_presigned_url(str(path), client_method='get_object', expires_in=3600)
+        elif self.use_nvdec:
+            import ffmpegcv
+            return ffmpegcv.VideoCaptureNV(path, pix_fmt='rgb24', gpu=self.gpu_id)  # RGB frames
         return cv2.VideoCapture(path)
 
     def _get_numpy(self, path):
@@ -221,26 +284,78 @@ class Comma2k19SequenceDataset(PlanningDataset):
         else:
             return np.load(path)
 
+    def _get_frame_count(self, cap):
+        # from the stream header, 0 if unknown
+        if self.use_nvdec:
+            return max(len(cap), 0)
+        return max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+
+    def _read_frames(self, cap, start_idx, end_idx):
+        # decode sequentially, but stop right after the last needed frame (or at the end of the video)
+        frames = []
+        for frame_idx in range(end_idx):
+            if frame_idx < start_idx and not self.use_nvdec:
+                ret = cap.grab()  # skip without retrieving/converting
+            elif frame_idx < start_idx:
+                ret, _ = cap.read()
+            else:
+                ret, frame = cap.read()
+                if ret:
+                    frames.append(frame)
+            if not ret:
+                break
+        return frames
+
+    def _load_cache(self, cache_path):
+        try:
+            input_img = torch.load(cache_path)
+            os.utime(cache_path)  # mark as recently used
+        except (FileNotFoundError, RuntimeError, EOFError):
+            return None
+        return input_img
+
+    def _save_cache(self, cache_path, input_img):
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        torch.save(input_img, tmp_path)
+        os.replace(tmp_path, cache_path)  # atomic, other workers never read a partial file
+
+        # evict the least recently used entries
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith('.pt'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:  # evicted by another worker
+                pass
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.cache_size_gb * 1024 ** 3:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
     def __getitem__(self, idx):
         seq_sample_path = self.prefix + self.samples[idx]
+
+        # poses (one per video frame)
+        frame_positions = self._get_numpy(seq_sample_path + '/global_pose/frame_positions')
+        frame_orientations = self._get_numpy(seq_sample_path + '/global_pose/frame_orientations')
+
         cap = self._get_cv2_vid(seq_sample_path + '/video.hevc')
         if (cap.isOpened() == False):
-            raise RuntimeError
-        imgs = []  # <--- all frames here
-        origin_imgs = []
-        while (cap.isOpened()):
-            ret, frame = cap.read()
-            if ret == True:
-                imgs.append(frame)
-                # cv2.imshow('frame', frame)
-                # cv2.waitKey(0)
-                if self.return_origin:
-                    origin_imgs.append(frame)
-            else:
-                break
-        cap.release()
+            raise RuntimeError('Cannot open ' + seq_sample_path + '/video.hevc')
 
-        seq_length = len(imgs)
+        # one pose per video frame, the window must fit into both
+        seq_length = len(frame_positions)
+        frame_count = self._get_frame_count(cap)
+        if 0 < frame_count < seq_length:
+            print('The video of sequence', seq_sample_path, 'has fewer frames than poses',
+                  '(%d < %d)' % (frame_count, seq_length))
+            seq_length = frame_count
 
         if self.mode == 'demo':
             self.fix_seq_length = seq_length - self.num_pts - 1
@@ -248,7 +363,8 @@ class Comma2k19SequenceDataset(PlanningDataset):
         if seq_length < self.fix_seq_length + self.num_pts:
             print('The length of sequence', seq_sample_path, 'is too short',
                   '(%d < %d)' % (seq_length, self.fix_seq_length + self.num_pts))
-            return self.__getitem__(idx+1)
+            cap.release()
+            return self.__getitem__((idx + 1) % len(self))
 
         seq_length_delta = seq_length - (self.fix_seq_length + self.num_pts)
         seq_length_delta = np.random.randint(1, seq_length_delta+1)
@@ -256,47 +372,64 @@ class Comma2k19SequenceDataset(PlanningDataset):
         seq_start_idx = seq_length_delta
         seq_end_idx = seq_length_delta + self.fix_seq_length
 
-        # seq_input_img
-        imgs = imgs[seq_start_idx-1: seq_end_idx]  # contains one more img
-        imgs = [cv2.warpPerspective(src=img, M=self.warp_matrix, dsize=(512,256), flags=cv2.WARP_INVERSE_MAP) for img in imgs]
-        imgs = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in imgs]
-        imgs = list(Image.fromarray(img) for img in imgs)
-        imgs = list(self.transforms(img)[None] for img in imgs)
-        input_img = torch.cat(imgs, dim=0)  # [N+1, 3, H, W]
-        del imgs
-        input_img = torch.cat((input_img[:-1, ...], input_img[1:, ...]), dim=1)
+        input_img = None
+        if self.cache_dir is not None and not self.return_origin:
+            cache_path = os.path.join(self.cache_dir, '%s_%d.pt' % (self.samples[idx].replace('/', '_'), seq_start_idx))
+            input_img = self._load_cache(cache_path)
+            if input_img is not None:
+                cap.release()
+
+        if input_img is None:
+            imgs = self._read_frames(cap, seq_start_idx-1, seq_end_idx)  # contains one more img
+            cap.release()
+            # the frame count in the header of a raw HEVC stream can be missing or off
+            if len(imgs) != seq_end_idx - seq_start_idx + 1:
+                print('The video of sequence', seq_sample_path, 'ended early',
+                      '(%d < %d frames)' % (seq_start_idx - 1 + len(imgs), seq_end_idx))
+                return self.__getitem__((idx + 1) % len(self))
+            if self.return_origin:
+                origin_imgs = imgs[1:]
+
+            # seq_input_img
+            imgs = [cv2.warpPerspective(src=img, M=self.warp_matrix, dsize=(512,256), flags=cv2.WARP_INVERSE_MAP) for img in imgs]
+            input_img = self.transforms(imgs, bgr=not self.use_nvdec)  # [N+1, 3, H, W], RGB, uint8
+            del imgs
+            if self.cache_dir is not None and not self.return_origin:
+                self._save_cache(cache_path, input_img)
+
+        # pair every frame with the previous one, written straight into the output buffer
+        frames = input_img
+        input_img = torch.empty((len(frames) - 1, 6) + tuple(frames.shape[-2:]), dtype=frames.dtype)
+        input_img[:, :3] = frames[:-1]
+        input_img[:, 3:] = frames[1:]
+        del frames
 
         # poses
-        frame_positions = self._get_numpy(self.prefix + self.samples[idx] + '/global_pose/frame_positions')[seq_start_idx: seq_end_idx+self.num_pts]
-        frame_orientations = self._get_numpy(self.prefix + self.samples[idx] + '/global_pose/frame_orientations')[seq_start_idx: seq_end_idx+self.num_pts]
-
-        future_poses = []
-        for i in range(self.fix_seq_length):
-            ecef_from_local = orient.rot_from_quat(frame_orientations[i])
-            local_from_ecef = ecef_from_local.T
-            frame_positions_local = np.einsum('ij,kj->ki', local_from_ecef, frame_positions - frame_positions[i]).astype(np.float32)
-
-            # Time-Anchor like OpenPilot
-            fs = [interp1d(self.t_idx, frame_positions_local[i: i+self.num_pts, j]) for j in range(3)]
-            interp_positions = [fs[j](self.t_anchors)[:, None] for j in range(3)]
-            interp_positions = np.concatenate(interp_positions, axis=1)
-            
-            future_poses.append(interp_positions)
-        future_poses = torch.tensor(np.array(future_poses), dtype=torch.float32)
+        frame_positions = frame_positions[seq_start_idx: seq_end_idx+self.num_pts]
+        frame_orientations = frame_orientations[seq_start_idx: seq_end_idx+self.num_pts]
+
+        # all time steps at once: positions of the next num_pts frames in the local frame of step i
+        local_from_ecef = batch_rot_from_quat(frame_orientations[:self.fix_seq_length]).transpose(0, 2, 1)  # N, 3, 3
+        windows = np.lib.stride_tricks.sliding_window_view(frame_positions, self.num_pts, axis=0)[:self.fix_seq_length]  # N, 3, num_pts (view)
+
+        # Time-Anchor like OpenPilot
+        # the interpolation weights sum to 1, so interpolating before the rigid transform gives the same result
+        anchor_positions = np.einsum('ak,nck->nac', self.interp_weights, windows)  # N, len(t_anchors), 3
+        future_poses = np.empty((self.fix_seq_length, len(self.t_anchors), 3), dtype=np.float32)
+        np.einsum('nij,naj->nai', local_from_ecef, anchor_positions - frame_positions[:self.fix_seq_length, None],
+                  out=future_poses, casting='same_kind')
+        future_poses = torch.from_numpy(future_poses)
 
         rtn_dict = dict(
-            seq_input_img=input_img,  # torch.Size([N, 6, 128, 256])
+            seq_input_img=input_img,  # torch.Size([N, 6, 128, 256]), uint8
             seq_future_poses=future_poses,  # torch.Size([N, num_pts, 3])
-            # camera_intrinsic=torch.tensor(seq_samples[0]['camera_intrinsic']),
-            # camera_extrinsic=torch.tensor(seq_samples[0]['camera_extrinsic']),
-            # camera_translation_inv=torch.tensor(seq_samples[0]['camera_translation_inv']),
-            # camera_rotation_matrix_inv=torch.tensor(seq_samples[0]['camera_rotation_matrix_inv']),
         )
 
         # For DEMO
         if self.return_origin:
-            origin_imgs = origin_imgs[seq_start_idx: seq_end_idx]
-            origin_imgs = [torch.tensor(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))[None] for img in origin_imgs]
+            if not self.use_nvdec:
+                origin_imgs = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in origin_imgs]
+            origin_imgs = [torch.tensor(img)[None] for img in origin_imgs]
             origin_imgs = torch.cat(origin_imgs, dim=0)  # N, H_ori, W_ori, 3
             rtn_dict['origin_imgs'] = origin_imgs
 
@@ -48,10 +48,8 @@ for b_idx, batch in enumerate(val_loader):
             pred_trajectory = pred_trajectory.reshape(planning_v0.M, planning_v0.num_pts, 3).cpu().numpy()
 
         inputs, labels = inputs.cpu(), labels.cpu()
-        vis_img = (inputs.permute(0, 2, 3, 1)[0] * torch.tensor((0.2172, 0.2141, 0.2209, 0.2172, 0.2141, 0.2209)) + torch.tensor((0.3890, 0.3937, 0.3851, 0.3890, 0.3937, 0.3851)) )  * 255
-        # print(vis_img.max(), vis_img.min(), vis_img.mean())
-        vis_img = vis_img.clamp(0, 255)
-        img_0, img_1 = vis_img[..., :3].numpy().astype(np.uint8), vis_img[..., 3:].numpy().astype(np.uint8)
+        vis_img = inputs.permute(0, 2, 3, 1)[0]  # uint8, the normalization happens inside the model
+        img_0, img_1 = vis_img[..., :3].numpy(), vis_img[..., 3:].numpy()
 
         # fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(nrows=2, ncols=2, figsize=(16, 9))
         # fig = plt.figure(figsize=(16, 9), constrained_layout=True)
@@ -3,7 +3,7 @@ import sys
 import time
 import random
 from tqdm import tqdm
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 
 import numpy as np
 import torch
@@ -22,7 +22,16 @@ else:
 
 from data import PlanningDataset, SequencePlanningDataset, Comma2k19SequenceDataset
 from model import PlaningNetwork, MultipleTrajectoryPredictionLoss, SequencePlanningNetwork
-from utils import draw_trajectory_on_ax, get_val_metric, get_val_metric_keys
+from utils import draw_trajectory_on_ax, get_val_metric, get_val_metric_keys, BackgroundIterator, CUDAPrefetcher
+
+
+def str2bool(v):
+    # type=bool would turn any non-empty string, including 'False', into True
+    if v.lower() in ('true', '1', 'yes'):
+        return True
+    if v.lower() in ('false', '0', 'no'):
+        return False
+    raise ArgumentTypeError('boolean value expected, got %s' % v)
 
 
 def get_hyperparameters(parser: ArgumentParser):
@@ -42,6 +51,10 @@ def get_hyperparameters(parser: ArgumentParser):
     parser.add_argument('--sync_bn', type=bool, default=True)
     parser.add_argument('--tqdm', type=bool, default=False)
     parser.add_argument('--optimize_per_n_step', type=int, default=40)
+    parser.add_argument('--use_nvdec', action='store_true')
+    parser.add_argument('--cache_dir', type=str, default='')  # e.g. a folder in /dev/shm, caches decoded validation frames
+    parser.add_argument('--cache_size_gb', type=float, default=16)
+    parser.add_argument('--bf16', type=str2bool, default=True)  # bf16 autocast, the optimizer stays in fp32
 
     try:
         exp_name = os.environ["SLURM_JOB_ID"]
@@ -58,9 +71,19 @@ def setup(rank, world_size):
     print('[%.2f]' % time.time(), 'DDP Initialized at %s:%s' % ('localhost', os.environ['PORT']), rank, 'of', world_size, flush=True)
 
 
-def get_dataloader(rank, world_size, batch_size, pin_memory=False, num_workers=0):
-    train = Comma2k19SequenceDataset('data/comma2k19_train_non_overlap.txt', 'data/comma2k19/','train', use_memcache=False)
-    val = Comma2k19SequenceDataset('data/comma2k19_val_non_overlap.txt', 'data/comma2k19/','demo', use_memcache=False)
+class DataLoaderX(DataLoader):
+    # fetch batches from the workers in a background thread, so the training loop never waits on the queue.
+    # A train batch is ~1 GB of pinned uint8 (6 x 800 x 6 x 128 x 256) and the workers already keep
+    # prefetch_factor batches each in flight, so one ready batch (plus the one being put) is enough here.
+    def __iter__(self):
+        return BackgroundIterator(super().__iter__(), max_prefetch=1)
+
+
+def get_dataloader(rank, world_size, batch_size, pin_memory=True, num_workers=0, use_nvdec=False, cache_dir=None, cache_size_gb=16):
+    train = Comma2k19SequenceDataset('data/comma2k19_train_non_overlap.txt', 'data/comma2k19/','train', use_memcache=False, use_nvdec=use_nvdec, gpu_id=rank)
+    # the validation windows start at a fixed frame, so only they are cached
+    val = Comma2k19SequenceDataset('data/comma2k19_val_non_overlap.txt', 'data/comma2k19/','demo', use_memcache=False, use_nvdec=use_nvdec, gpu_id=rank,
+                                   cache_dir=cache_dir or None, cache_size_gb=cache_size_gb)
 
     if torch.__version__ == 'parrots':
         dist_sampler_params = dict(num_replicas=world_size, rank=rank, shuffle=True)
@@ -70,8 +93,8 @@ def get_dataloader(rank, world_size, batch_size, pin_memory=False, num_workers=0
     val_sampler = DistributedSampler(val, **dist_sampler_params)
 
     loader_args = dict(num_workers=num_workers, persistent_workers=True if num_workers > 0 else False, prefetch_factor=2, pin_memory=pin_memory)
-    train_loader = DataLoader(train, batch_size, sampler=train_sampler, **loader_args)
-    val_loader = DataLoader(val, batch_size=1, sampler=val_sampler, **loader_args)
+    train_loader = DataLoaderX(train, batch_size, sampler=train_sampler, **loader_args)
+    val_loader = DataLoaderX(val, batch_size=1, sampler=val_sampler, **loader_args)
 
     return train_loader, val_loader
 
@@ -92,6 +115,10 @@ class SequenceBaselineV1(nn.Module):
 
         self.optimize_per_n_step = optimize_per_n_step  # for the gru module
 
+        # the datasets return uint8 images, normalized here on the GPU (two RGB frames per input)
+        self.register_buffer('mean', torch.tensor([0.3890, 0.3937, 0.3851] * 2).view(6, 1, 1) * 255, persistent=False)
+        self.register_buffer('std', torch.tensor([0.2172, 0.2141, 0.2209] * 2).view(6, 1, 1) * 255, persistent=False)
+
     @staticmethod
     def configure_optimizers(args, model):
         if args.optimizer == 'sgd':
@@ -106,9 +133,15 @@ class SequenceBaselineV1(nn.Module):
 
         return optimizer, lr_scheduler
 
+    def normalize(self, x):
+        # x: [..., 6, H, W] uint8
+        return (x.float() - self.mean) / self.std
+
     def forward(self, x, hidden=None):
         if hidden is None:
             hidden = torch.zeros((2, x.size(0), 512)).to(self.device)
+        if x.dtype == torch.uint8:
+            x = self.normalize(x)
         return self.net(x, hidden)
 
 
@@ -116,12 +149,16 @@ def main(rank, world_size, args):
     if rank == 0:
         writer = SummaryWriter()
 
-    train_dataloader, val_dataloader = get_dataloader(rank, world_size, args.batch_size, False, args.n_workers)
+    # avoid oversubscribing the CPUs this rank is bound to (e.g. --cpus-per-task), os.cpu_count() counts the whole node
+    n_workers = min(args.n_workers, len(os.sched_getaffinity(0)))
+    train_dataloader, val_dataloader = get_dataloader(rank, world_size, args.batch_size, True, n_workers, args.use_nvdec, args.cache_dir, args.cache_size_gb)
+    # overlap the host-to-device copy of the next batch with the compute of the current one
+    train_prefetcher, val_prefetcher = CUDAPrefetcher(train_dataloader), CUDAPrefetcher(val_dataloader)
     model = SequenceBaselineV1(args.M, args.num_pts, args.mtp_alpha, args.lr, args.optimizer, args.optimize_per_n_step)
     use_sync_bn = args.sync_bn
     if use_sync_bn:
         model = nn.SyncBatchNorm.convert_sync_batchnorm(model)
-    model = model.cuda()
+    model = model.cuda().to(memory_format=torch.channels_last)  # NHWC for the CNN backbone
     optimizer, lr_scheduler = model.configure_optimizers(args, model)
     model: SequenceBaselineV1
     if args.resume and rank == 0:
@@ -137,22 +174,25 @@ def main(rank, world_size, args):
     for epoch in tqdm(range(args.epochs), disable=disable_tqdm, position=0):
         train_dataloader.sampler.set_epoch(epoch)
         
-        for batch_idx, data in enumerate(tqdm(train_dataloader, leave=False, disable=disable_tqdm, position=1)):
-            seq_inputs, seq_labels = data['seq_input_img'].cuda(), data['seq_future_poses'].cuda()
+        for batch_idx, data in enumerate(tqdm(train_prefetcher, leave=False, disable=disable_tqdm, position=1)):
+            seq_inputs, seq_labels = data['seq_input_img'], data['seq_future_poses']  # already on the GPU
             bs = seq_labels.size(0)
             seq_length = seq_labels.size(1)
             
             hidden = torch.zeros((2, bs, 512)).cuda()
-            total_loss = 0
-            for t in tqdm(range(seq_length), leave=False, disable=disable_tqdm, position=2):
-                num_steps += 1
-                inputs, labels = seq_inputs[:, t, :, :, :], seq_labels[:, t, :, :]
-                pred_cls, pred_trajectory, hidden = model(inputs, hidden)
-
-                cls_loss, reg_loss = loss(pred_cls, pred_trajectory, labels)
-                total_loss += (cls_loss + args.mtp_alpha * reg_loss.mean()) / model.module.optimize_per_n_step
-            
-                if rank == 0 and (num_steps + 1) % args.log_per_n_step == 0:
+            chunk_size = model.module.optimize_per_n_step
+            # the backbone runs once per chunk of optimize_per_n_step frames, followed by one optimizer step
+            for t in tqdm(range(0, seq_length, chunk_size), leave=False, disable=disable_tqdm, position=2):
+                inputs, labels = seq_inputs[:, t: t+chunk_size], seq_labels[:, t: t+chunk_size]
+                chunk_length = labels.size(1)
+                with torch.autocast('cuda', dtype=torch.bfloat16, enabled=args.bf16):
+                    pred_cls, pred_trajectory, hidden = model(inputs, hidden)
+                    cls_loss, reg_loss = loss(pred_cls.flatten(0, 1), pred_trajectory.flatten(0, 1), labels.flatten(0, 1))
+                # same scale as summing the per-frame losses divided by optimize_per_n_step
+                total_loss = (cls_loss + args.mtp_alpha * reg_loss.mean()) * chunk_length / chunk_size
+
+                prev_num_steps, num_steps = num_steps, num_steps + chunk_length
+                if rank == 0 and (num_steps + 1) // args.log_per_n_step != (prev_num_steps + 1) // args.log_per_n_step:
                     # TODO: add a customized log function
                     writer.add_scalar('train/epoch', epoch, num_steps)
                     writer.add_scalar('loss/cls', cls_loss, num_steps)
@@ -162,17 +202,7 @@ def main(rank, world_size, args):
                     writer.add_scalar('loss/reg_z', reg_loss[2], num_steps)
                     writer.add_scalar('param/lr', optimizer.param_groups[0]['lr'], num_steps)
 
-                if (t + 1) % model.module.optimize_per_n_step == 0:
-                    hidden = hidden.clone().detach()
-                    optimizer.zero_grad()
-                    total_loss.backward()
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)  # TODO: move to args
-                    optimizer.step()
-                    if rank == 0:
-                        writer.add_scalar('loss/total', total_loss, num_steps)
-                    total_loss = 0
-
-            if not isinstance(total_loss, int):
+                hidden = hidden.clone().detach()
                 optimizer.zero_grad()
                 total_loss.backward()
                 torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)  # TODO: move to args
@@ -191,21 +221,25 @@ def main(rank, world_size, args):
             model.eval()
             with torch.no_grad():
                 saved_metric_epoch = get_val_metric_keys()
-                for batch_idx, data in enumerate(tqdm(val_dataloader, leave=False, disable=disable_tqdm, position=1)):
-                    seq_inputs, seq_labels = data['seq_input_img'].cuda(), data['seq_future_poses'].cuda()
+                for batch_idx, data in enumerate(tqdm(val_prefetcher, leave=False, disable=disable_tqdm, position=1)):
+                    seq_inputs, seq_labels = data['seq_input_img'], data['seq_future_poses']
 
                     bs = seq_labels.size(0)
                     seq_length = seq_labels.size(1)
                     
                     hidden = torch.zeros((2, bs, 512), device=seq_inputs.device)
-                    for t in tqdm(range(seq_length), leave=False, disable=True, position=2):
-                        inputs, labels = seq_inputs[:, t, :, :, :], seq_labels[:, t, :, :]
-                        pred_cls, pred_trajectory, hidden = model(inputs, hidden)
-
-                        metrics = get_val_metric(pred_cls, pred_trajectory.view(-1, args.M, args.num_pts, 3), labels)
-                        
-                        for k, v in metrics.items():
-                            saved_metric_epoch[k].append(v.float().mean().item())
+                    chunk_size = model.module.optimize_per_n_step
+                    for t in tqdm(range(0, seq_length, chunk_size), leave=False, disable=True, position=2):
+                        inputs, labels = seq_inputs[:, t: t+chunk_size], seq_labels[:, t: t+chunk_size]
+                        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=args.bf16):
+                            pred_cls, pred_trajectory, hidden = model(inputs, hidden)
+
+                        # metrics are still averaged per frame
+                        for i in range(labels.size(1)):
+                            metrics = get_val_metric(pred_cls[:, i].float(), pred_trajectory[:, i].float(), labels[:, i])
+
+                            for k, v in metrics.items():
+                                saved_metric_epoch[k].append(v.float().mean().item())
                 
                 dist.barrier()  # Wait for all processes
                 # sync
@@ -83,10 +83,37 @@ class SequencePlanningNetwork(nn.Module):
         )
 
     def forward(self, x, hidden):
+        """
+        x: [B, 6, H, W] for a single step, or [B, T, 6, H, W] for T consecutive steps
+        hidden: [2, B, 512]
+        """
+        if x.dim() == 5:
+            return self.forward_sequence(x, hidden)
+
         features = self.backbone.extract_features(x)
 
         raw_preds = self.plan_head(features)
         raw_preds, hidden = self.gru(raw_preds[:, None, :], hidden)  # N, L, H_in for batch_first=True
+        return (*self.decode(raw_preds), hidden)
+
+    def forward_sequence(self, x, hidden):
+        B, T = x.shape[:2]
+        # the backbone sees all T frames as one batch
+        features = self.backbone.extract_features(x.flatten(0, 1).contiguous(memory_format=torch.channels_last))
+        features = self.plan_head(features).view(B, T, -1)
+
+        # the bidirectional GRU is still stepped with length-1 sequences, running it over
+        # the whole chunk at once would let the reverse direction see future frames
+        raw_preds = []
+        for t in range(T):
+            raw_pred, hidden = self.gru(features[:, t:t+1], hidden)
+            raw_preds.append(raw_pred)
+        raw_preds = torch.cat(raw_preds, dim=1).flatten(0, 1)  # B*T, 1024
+
+        pred_cls, pred_trajectory = self.decode(raw_preds)
+        return pred_cls.reshape(B, T, self.M), pred_trajectory.reshape(B, T, self.M, self.num_pts, 3), hidden
+
+    def decode(self, raw_preds):
         raw_preds = self.plan_head_tip(raw_preds)
 
         pred_cls = raw_preds[:, :self.M]
@@ -95,7 +122,7 @@ class SequencePlanningNetwork(nn.Module):
         pred_xs = pred_trajectory[:, :, :, 0:1].exp()
         pred_ys = pred_trajectory[:, :, :, 1:2].sinh()
         pred_zs = pred_trajectory[:, :, :, 2:3]
-        return pred_cls, torch.cat((pred_xs, pred_ys, pred_zs), dim=3), hidden
+        return pred_cls, torch.cat((pred_xs, pred_ys, pred_zs), dim=3)
 
 
 class AbsoluteRelativeErrorLoss(nn.Module):
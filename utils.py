@@ -1,3 +1,5 @@
+import queue
+import threading
 import cv2
 import numpy as np
 import matplotlib
@@ -105,6 +107,110 @@ def get_val_metric_keys(namespace='val'):
     return rtn_dict
 
 
+class ResizeToTensor:
+    '''
+    Batched equivalent of Compose([Resize(size), PILToTensor()]), the images stay uint8.
+    The normalization is done on the GPU, see SequenceBaselineV1.normalize.
+    imgs: List of uint8 numpy arrays of shape (H, W, 3), all of the same size
+    bgr: whether imgs are in OpenCV's BGR order, they are flipped to RGB after resizing
+    returns: uint8 tensor of shape (N, 3, size[0], size[1])
+    '''
+    def __init__(self, size, chunk_size=32):
+        self.size = tuple(size)
+        self.chunk_size = chunk_size  # bounds the float32 full-size intermediate
+
+    def __call__(self, imgs, bgr=False):
+        out = torch.empty((len(imgs), 3) + self.size, dtype=torch.uint8)
+        for i in range(0, len(imgs), self.chunk_size):
+            chunk = torch.from_numpy(np.stack(imgs[i: i+self.chunk_size])).permute(0, 3, 1, 2)
+            if tuple(chunk.shape[-2:]) != self.size:
+                chunk = F.interpolate(chunk.float(), size=self.size, mode='bilinear', align_corners=False, antialias=True)
+                chunk = chunk.round_().clamp_(0, 255)
+            if bgr:
+                chunk = chunk.flip(1)
+            out[i: i+self.chunk_size] = chunk
+        return out
+
+
+class BackgroundIterator(threading.Thread):
+    '''
+    Runs an iterator in a daemon thread and hands its items over through a queue of max_prefetch items.
+    An exception raised by the iterator (e.g. a failed DataLoader worker) is re-raised in the consumer,
+    which would otherwise wait on the queue forever.
+    '''
+    _end = object()
+
+    class _Error:
+        def __init__(self, exc):
+            self.exc = exc
+
+    def __init__(self, iterator, max_prefetch=1):
+        super().__init__(daemon=True)
+        self.iterator = iterator
+        self.queue = queue.Queue(max_prefetch)
+        self.done = False
+        self.start()
+
+    def run(self):
+        try:
+            for item in self.iterator:
+                self.queue.put(item)
+        except BaseException as e:
+            self.queue.put(self._Error(e))
+        else:
+            self.queue.put(self._end)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        item = self.queue.get()
+        if item is self._end:
+            self.done = True
+            raise StopIteration
+        if isinstance(item, self._Error):
+            self.done = True
+            raise item.exc
+        return item
+
+
+class CUDAPrefetcher:
+    '''
+    Wraps a DataLoader and copies the next batch to the current GPU on a side stream
+    while the current batch is being consumed. Needs pin_memory=True to overlap.
+    Batches are dicts, the tensors in them are moved to the GPU.
+    '''
+    def __init__(self, loader):
+        self.loader = loader
+        self.stream = torch.cuda.Stream()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, loader_iter):
+        try:
+            batch = next(loader_iter)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return {k: v.cuda(non_blocking=True) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+
+    def __iter__(self):
+        loader_iter = iter(self.loader)
+        batch = self._preload(loader_iter)
+        while batch is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            for v in batch.values():
+                if isinstance(v, torch.Tensor):
+                    v.record_stream(current_stream)  # allocated on the side stream, used on this one
+            next_batch = self._preload(loader_iter)
+            yield batch
+            batch = next_batch
+
+
 def generate_random_params_for_warp(img, random_rate=0.1):
     h, w = img.shape[:2]
 
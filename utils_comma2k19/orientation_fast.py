@@ -0,0 +1,44 @@
+'''
+Batched quaternion to rotation matrix conversion, compiled with numba when
+it is available. Same convention as orientation.quat2rot (scalar first).
+Falls back to the vectorized numpy implementation otherwise.
+'''
+
+import numpy as np
+from utils_comma2k19.orientation import quat2rot
+
+try:
+  from numba import njit
+except ImportError:
+  njit = None
+
+
+def _quat2rot_loop(quats):
+  Rs = np.empty((quats.shape[0], 3, 3))
+  for i in range(quats.shape[0]):
+    q0, q1, q2, q3 = quats[i, 0], quats[i, 1], quats[i, 2], quats[i, 3]
+    Rs[i, 0, 0] = q0 * q0 + q1 * q1 - q2 * q2 - q3 * q3
+    Rs[i, 0, 1] = 2 * (q1 * q2 - q0 * q3)
+    Rs[i, 0, 2] = 2 * (q0 * q2 + q1 * q3)
+    Rs[i, 1, 0] = 2 * (q1 * q2 + q0 * q3)
+    Rs[i, 1, 1] = q0 * q0 - q1 * q1 + q2 * q2 - q3 * q3
+    Rs[i, 1, 2] = 2 * (q2 * q3 - q0 * q1)
+    Rs[i, 2, 0] = 2 * (q1 * q3 - q0 * q2)
+    Rs[i, 2, 1] = 2 * (q0 * q1 + q2 * q3)
+    Rs[i, 2, 2] = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+  return Rs
+
+
+# single-threaded on purpose, this runs inside DataLoader workers
+_quat2rot_jit = njit(cache=True, fastmath=True)(_quat2rot_loop) if njit is not None else None
+
+
+def batch_rot_from_quat(quats):
+  '''
+  quats: array of shape (N, 4)
+  returns: array of shape (N, 3, 3)
+  '''
+  quats = np.atleast_2d(np.asarray(quats, dtype=np.float64))
+  if _quat2rot_jit is None:
+    return quat2rot(quats)
+  return _quat2rot_jit(quats)